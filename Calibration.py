@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Fitting and storage of the sensor calibration: the CO2 sensor offsets from
+bench experiments and the pressure regression from chamber experiments.
+Fitted values are kept with a version number in a calibration table that
+FlightData and Profile look up when they are created.
+"""
+import datetime
+import json
+import os
+import tempfile
+
+import numpy as np
+
+#the calibration table FlightData and Profile use by default
+CALIBRATION_FILE = "calibration.json"
+
+CALIBRATION_KEYS = ("CO2_sensor1_offset", "CO2_sensor2_offset",
+                    "regression_slope", "regression_intercept")
+
+def _concatenate(datasets):
+    """ Returns the datasets joined into one array along with the index
+    where each dataset starts and its length
+    """
+    arrays = [np.asarray(dataset, dtype=float) for dataset in datasets]
+    lengths = np.array([array.size for array in arrays])
+    if (lengths.size == 0 or lengths.min() < 1):
+        raise ValueError("Every dataset needs at least one reading")
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    return np.concatenate(arrays), starts, lengths
+
+def fit_sensor_offsets(references, sensor1_readings, sensor2_readings):
+    """ Returns a dictionary with the least squares offsets of the two CO2
+    sensors, fitted to every bench dataset at once. CO2_sensor1_offset and
+    CO2_sensor2_offset are fitted to all readings pooled together, and
+    sensor1_offsets and sensor2_offsets hold the fit to each dataset.
+
+    :param list references: One array of reference CO2 ppm per dataset
+    :param list sensor1_readings: One array of sensor 1 readings per dataset
+    :param list sensor2_readings: One array of sensor 2 readings per dataset
+    """
+    reference, starts, lengths = _concatenate(references)
+    results = {}
+    for number, readings in ((1, sensor1_readings), (2, sensor2_readings)):
+        readings, _, sensor_lengths = _concatenate(readings)
+        if not np.array_equal(lengths, sensor_lengths):
+            raise ValueError(f"Sensor {number} datasets do not match the reference datasets")
+        #the least squares constant offset is the mean difference
+        differences = reference - readings
+        results[f"CO2_sensor{number}_offset"] = float(differences.mean())
+        results[f"sensor{number}_offsets"] = np.add.reduceat(differences, starts) / lengths
+    return results
+
+def fit_pressure_regression(pressures, ppms):
+    """ Returns a dictionary with the least squares line ppm = slope * pressure
+    + intercept fitted to every chamber dataset at once. regression_slope and
+    regression_intercept are the averages of the per-dataset fits (like the
+    original average of the three chamber regressions), and slopes and
+    intercepts hold the fit to each dataset.
+
+    :param list pressures: One array of pressures (hPa) per dataset
+    :param list ppms: One array of CO2 readings per dataset
+    """
+    pressure, starts, lengths = _concatenate(pressures)
+    ppm, _, ppm_lengths = _concatenate(ppms)
+    if not np.array_equal(lengths, ppm_lengths):
+        raise ValueError("The pressure and CO2 datasets do not match")
+    if (lengths.min() < 2):
+        raise ValueError("Every chamber dataset needs at least two readings")
+
+    #closed form least squares from the sums over each dataset
+    sum_x, sum_y, sum_xx, sum_xy = np.add.reduceat(
+        np.stack([pressure, ppm, pressure * pressure, pressure * ppm]), starts, axis=1)
+    slopes = (lengths * sum_xy - sum_x * sum_y) / (lengths * sum_xx - sum_x ** 2)
+    intercepts = (sum_y - slopes * sum_x) / lengths
+    return {"regression_slope": float(slopes.mean()),
+            "regression_intercept": float(intercepts.mean()),
+            "slopes": slopes,
+            "intercepts": intercepts}
+
+def fit_calibration(bench_datasets = (), chamber_datasets = ()):
+    """ Returns a dictionary with the calibration values fitted from bench
+    and chamber datasets, ready for CalibrationTable.add. Values that have no
+    datasets are left out.
+
+    :param list bench_datasets: (reference, sensor1, sensor2) array triples
+    :param list chamber_datasets: (pressures, ppms) array pairs
+    """
+    calibration = {}
+    if bench_datasets:
+        offsets = fit_sensor_offsets(*zip(*bench_datasets))
+        calibration["CO2_sensor1_offset"] = offsets["CO2_sensor1_offset"]
+        calibration["CO2_sensor2_offset"] = offsets["CO2_sensor2_offset"]
+    if chamber_datasets:
+        regression = fit_pressure_regression(*zip(*chamber_datasets))
+        calibration["regression_slope"] = regression["regression_slope"]
+        calibration["regression_intercept"] = regression["regression_intercept"]
+    return calibration
+
+def sweep_linear_correction(flights, slopes):
+    """ Returns a list with the linear pressure correction of each flight
+    evaluated for every slope at once, each of shape slopes.shape + (N,)
+    for a flight of N readings. All flights are corrected in one broadcast
+    over their joined readings. The intercept of the regression cancels out
+    of the correction, so only the slope is swept.
+
+    :param list flights: (ppms, pressures) array pairs, one per flight, with\
+        the sensor offsets already applied and pressures in hPa
+    :param slopes: array of regression slopes to try
+    """
+    ppms, starts, lengths = _concatenate([ppm for ppm, pressure in flights])
+    pressures, _, _ = _concatenate([pressure for ppm, pressure in flights])
+    initial_pressures = np.repeat(pressures[starts], lengths)
+
+    slopes = np.asarray(slopes, dtype=float)[..., np.newaxis]
+    corrected = ppms - slopes * (pressures - initial_pressures)
+    return np.split(corrected, starts[1:], axis=-1)
+
+def resolve(calibration = None, path = CALIBRATION_FILE):
+    """ Returns the calibration entry to use, or None to fall back on the
+    constants in FlightData and Profile.
+
+    :param calibration: None for the latest entry of the table, a version\
+        number from the table, or a dictionary of calibration values
+    :param str path: path of the calibration table
+    """
+    if isinstance(calibration, dict):
+        return calibration
+    return CalibrationTable.load(path).get(calibration)
+
+class CalibrationTable():
+    """ A versioned table of calibrations stored in a JSON file. Every entry
+    holds the sensor offsets, the regression slope and intercept, its
+    version number, when it was added, and a note on where it came from.
+
+    :var str path: path of the JSON file
+    :var list entries: calibration entries, oldest first
+    """
+
+    def __init__(self, path = CALIBRATION_FILE, entries = None):
+        """ Creates a CalibrationTable. Use CalibrationTable.load to read an
+        existing file.
+
+        :param str path: path of the JSON file
+        :param list entries: calibration entries, oldest first
+        """
+        self.path = path
+        self.entries = list(entries or [])
+
+    @classmethod
+    def load(cls, path = CALIBRATION_FILE):
+        """ Returns the CalibrationTable stored at path, or an empty table if
+        the file does not exist
+
+        :param str path: path of the JSON file
+        """
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'r') as read_file:
+            return cls(path, json.load(read_file)["entries"])
+
+    def save(self):
+        """ Writes the table to its JSON file
+        """
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'w') as write_file:
+                json.dump({"entries": self.entries}, write_file, indent=2)
+            os.replace(temporary_path, self.path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def get(self, version = None):
+        """ Returns the entry with the given version number, or the latest
+        entry if version is None. Returns None if the table is empty.
+
+        :param int version: version number of the entry
+        """
+        if (version is None):
+            return self.entries[-1] if self.entries else None
+        for entry in self.entries:
+            if entry["version"] == version:
+                return entry
+        raise KeyError(f"There is no calibration version {version} in {self.path}")
+
+    def add(self, calibration, note = ""):
+        """ Adds a calibration as a new version, saves the table, and returns
+        the new entry. Values missing from calibration are carried over from
+        the latest entry.
+
+        :param dict calibration: values for some or all of CALIBRATION_KEYS,\
+            e.g. from fit_calibration
+        :param str note: where the calibration came from
+        """
+        entry = {key: self.entries[-1][key] for key in CALIBRATION_KEYS} if self.entries else {}
+        entry.update({key: float(calibration[key]) for key in CALIBRATION_KEYS if key in calibration})
+        missing = [key for key in CALIBRATION_KEYS if key not in entry]
+        if missing:
+            raise ValueError(f"The first calibration needs values for {missing}")
+
+        entry["version"] = self.entries[-1]["version"] + 1 if self.entries else 1
+        entry["created"] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+        entry["note"] = note
+        self.entries.append(entry)
+        self.save()
+        return entry
@@ -4,52 +4,91 @@ Created on Tue Mar  9 08:23:00 2021
 
 @author: nimzodragonlord
 """
+import argparse
 import sys
+import hashlib
+import json
+import numpy as np
 import pandas as pd
 import csv
 import os
+import tempfile
 import datetime
-import statistics
-from matplotlib import pyplot as plt
+import functools
+import itertools
+import concurrent.futures
+import Calibration
 
 class FlightData():
     """ Reads in data from an ALL csv file and stores it in a Pandas dataframe along with providing static methods for file conversion
     
-    :var double CO2_sensor1_offset: bench-calculated offset for CO2 sensor 1
-    :var double CO2_sensor2_offset: bench-calculated offset for CO2 sensor 2
+    :var double CO2_sensor1_offset: bench-calculated offset for CO2 sensor 1,\
+        used when there is no calibration table
+    :var double CO2_sensor2_offset: bench-calculated offset for CO2 sensor 2,\
+        used when there is no calibration table
+    :var tuple DERIVED_QUANTITIES: names of the quantities get_derived computes
+    :var list COLUMNS: names of the dataframe columns, in ALL csv order
     
     
     """
     CO2_sensor1_offset = 27.69
     CO2_sensor2_offset = -16.11
+    DERIVED_QUANTITIES = ("potential_temperature", "vapor_pressure",
+                          "mixing_ratio", "dry_CO2")
+    COLUMNS = ['TimeStampUTC (ms)',
+               'Altitude (m)',
+               'Pressure (hPa)',
+               'CO2_1 (ppm)',
+               'CO2_2 (ppm)',
+               'TEMP1 (K)',
+               'TEMP2 (K)',
+               'TEMP3 (K)',
+               'TEMP4 (K)',
+               'RHUM1',
+               'RHUM2',
+               'RHUM3',
+               'RHUM4']
     
     #Constructor that reads in data from the ALL csv file and creates a pandas dataframe
-    def __init__(self, csvFilePath):
+    def __init__(self, csvFilePath, calibration = None):
         
         """ Creates a FlightData object that is a Pandas dataframe containing the flight data
         
-        :param str csvFilePath: file path to the ALL csv
+        :param csvFilePath: file path to the ALL csv, or a dataframe in the\
+            layout of the ALL csv (e.g. from merge_sensor_data) to use\
+            without going through a file. A dataframe whose columns are\
+            already (some of) the names in COLUMNS is used as it is.
+        :param calibration: None (default) for the latest calibration in the\
+            calibration table, a version number from the table, or a\
+            dictionary of calibration values (see Calibration.py). Without a\
+            calibration table the class constants are used.
         
         """
         
-        
-        self.dataframe = pd.read_csv(csvFilePath, skiprows=1, names=['TimeStampUTC (ms)',
-                                                                     'Altitude (m)',
-                                                                     'Pressure (hPa)',
-                                                                     'CO2_1 (ppm)',
-                                                                     'CO2_2 (ppm)',
-                                                                     'TEMP1 (K)',
-                                                                     'TEMP2 (K)',
-                                                                     'TEMP3 (K)',
-                                                                     'TEMP4 (K)',
-                                                                     'RHUM1',
-                                                                     'RHUM2',
-                                                                     'RHUM3',
-                                                                     'RHUM4'
-                                                                     ])
+        if isinstance(csvFilePath, pd.DataFrame):
+            if set(csvFilePath.columns) <= set(self.COLUMNS):
+                #already named like FlightData columns, possibly only some of them
+                self.dataframe = csvFilePath.reset_index(drop=True)
+            else:
+                self.dataframe = csvFilePath.set_axis(self.COLUMNS, axis=1).reset_index(drop=True)
+        else:
+            self.dataframe = pd.read_csv(csvFilePath, skiprows=1, names=self.COLUMNS)
+        
+        #looking up the sensor offsets and pressure regression
+        self.calibration = Calibration.resolve(calibration)
+        self.regression_slope = Profile.REGRESSION_SLOPE
+        self.regression_intercept = Profile.REGRESSION_INTERCEPT
+        if (self.calibration is not None):
+            self.CO2_sensor1_offset = self.calibration["CO2_sensor1_offset"]
+            self.CO2_sensor2_offset = self.calibration["CO2_sensor2_offset"]
+            self.regression_slope = self.calibration["regression_slope"]
+            self.regression_intercept = self.calibration["regression_intercept"]
         #a note about the temperatures:
         #TEMP1 is positioned differently than the other three sensors
         #TEMP2,3,4 should match up well and should be used for derived measurements
+        
+        #derived quantities are computed on request by get_derived
+        self.derived_columns = {}
     
     def get_UTC_times(self):
         """ Returns a list of datetime objects in UTC time from the\
@@ -103,9 +142,10 @@ class FlightData():
         avg_CO2_readings = self.get_avgCO2_with_Offset()
         pressures = self.get_pressures()
         initial_pressure = pressures[0]
-        offset = avg_CO2_readings[0] - Profile.lRegression(initial_pressure, 0)
-        pivot = Profile.lRegression(initial_pressure, offset)
-        corrected_CO2_readings = [ppm + (pivot - Profile.lRegression(P, offset)) for ppm, P in zip(avg_CO2_readings, pressures)]
+        slope, intercept = self.regression_slope, self.regression_intercept
+        offset = avg_CO2_readings[0] - Profile.lRegression(initial_pressure, 0, slope, intercept)
+        pivot = Profile.lRegression(initial_pressure, offset, slope, intercept)
+        corrected_CO2_readings = [ppm + (pivot - Profile.lRegression(P, offset, slope, intercept)) for ppm, P in zip(avg_CO2_readings, pressures)]
         return corrected_CO2_readings
         
     
@@ -149,6 +189,236 @@ class FlightData():
         
         return rhums
 
+    def get_derived(self, names):
+        """ Returns a dictionary of numpy arrays, one for each requested\
+            derived quantity. The typed columns are read once and only the\
+            requested quantities (and what they depend on) are computed;\
+            results are cached on the FlightData object.
+            
+            potential_temperature: potential temperature in K\
+            vapor_pressure: water vapor pressure in hPa\
+            mixing_ratio: water vapor mixing ratio in g/kg\
+            dry_CO2: average CO2 reading with the sensor offsets applied,\
+            corrected for dilution by water vapor (ppm in dry air)
+            
+            :param list names: names from DERIVED_QUANTITIES, or a single name
+        """
+        if isinstance(names, str):
+            names = [names]
+        names = list(names)
+        for name in names:
+            if name not in self.DERIVED_QUANTITIES:
+                raise ValueError(f"Unknown derived quantity {name}; choose from {self.DERIVED_QUANTITIES}")
+        missing = {name for name in names if name not in self.derived_columns}
+        
+        if (missing):
+            columns = self.dataframe[['Pressure (hPa)', 'CO2_1 (ppm)', 'CO2_2 (ppm)',
+                                      'TEMP2 (K)', 'TEMP3 (K)', 'TEMP4 (K)',
+                                      'RHUM2', 'RHUM3', 'RHUM4']].to_numpy(dtype=float)
+            pressure = columns[:, 0] / 100
+            temperature = columns[:, 3:6].mean(axis=1)
+            
+            if ("potential_temperature" in missing):
+                self.derived_columns["potential_temperature"] = temperature * (1000 / pressure) ** 0.2857
+            
+            if (missing & {"vapor_pressure", "mixing_ratio", "dry_CO2"}):
+                #saturation vapor pressure from Bolton (1980)
+                celsius = temperature - 273.15
+                vapor_pressure = columns[:, 6:9].mean(axis=1) / 100 * 6.112 * np.exp(17.67 * celsius / (celsius + 243.5))
+                self.derived_columns["vapor_pressure"] = vapor_pressure
+                
+                if ("mixing_ratio" in missing):
+                    self.derived_columns["mixing_ratio"] = 622 * vapor_pressure / (pressure - vapor_pressure)
+                if ("dry_CO2" in missing):
+                    avgCO2 = ((columns[:, 1] + self.CO2_sensor1_offset) + (columns[:, 2] + self.CO2_sensor2_offset)) / 2
+                    self.derived_columns["dry_CO2"] = avgCO2 / (1 - vapor_pressure / pressure)
+        
+        return {name: self.derived_columns[name] for name in names}
+
+    def trim(self, start_time, end_time):
+        """ Returns a new FlightData object with only the readings between\
+            the supplied timestamps, like trim_ALL_CSV without the files
+            
+            :param int start_time: timestamp to start recording values
+            :param int end_time: timestamp to stop recording values
+        """
+        times = self.dataframe['TimeStampUTC (ms)']
+        return FlightData(self.dataframe[(times > start_time) & (times < end_time)],
+                          calibration=self.calibration)
+    
+    @classmethod
+    def from_arrays(cls, timestamps, altitudes, pressures, CO2_1, CO2_2,
+                    temperatures, humidities, calibration = None):
+        """ Returns a FlightData object built from arrays of readings
+        
+        :param timestamps: unix timestamps in seconds
+        :param altitudes: altitudes in meters
+        :param pressures: pressures in the units of the ALL csv (Pa)
+        :param CO2_1: readings from CO2 sensor 1 without the offset
+        :param CO2_2: readings from CO2 sensor 2 without the offset
+        :param temperatures: temperatures in K, either one array used for\
+            all four sensors or a sequence of four arrays
+        :param humidities: relative humidities, either one array used for\
+            all four sensors or a sequence of four arrays
+        :param calibration: see the constructor
+        """
+        temperatures = np.asarray(temperatures, dtype=float)
+        humidities = np.asarray(humidities, dtype=float)
+        if (temperatures.ndim == 1):
+            temperatures = np.tile(temperatures, (4, 1))
+        if (humidities.ndim == 1):
+            humidities = np.tile(humidities, (4, 1))
+        
+        columns = [timestamps, altitudes, pressures, CO2_1, CO2_2, *temperatures, *humidities]
+        return cls(pd.DataFrame(dict(zip(cls.COLUMNS, columns))), calibration)
+    
+    @classmethod
+    def load_many(cls, paths, max_workers = 8, use_processes = False, **kwargs):
+        """ Yields a FlightData object for each file as soon as it has been\
+            read, reading several files at a time. Files on network storage\
+            spend most of their time waiting, so threads (the default) are\
+            usually enough; use_processes also spreads the parsing over CPUs.
+            
+            :param list paths: ALL csv paths (or dataframes) to read
+            :param int max_workers: files read at the same time; 8 default
+            :param bool use_processes: use a process pool instead of threads
+            
+            Any other keyword arguments are passed to the constructor.
+        """
+        yield from _load_concurrently(functools.partial(cls, **kwargs), paths,
+                                      max_workers, use_processes)
+    
+    @classmethod
+    def scan(cls, paths, columns = None, time_range = None, altitude_range = None,
+             calibration = None):
+        """ Returns a FlightData object with only the requested rows and\
+            columns of one or more ALL files, read with Apache Arrow.\
+            Requires the pyarrow library.
+            
+            The column selection and the time and altitude filters are\
+            handed to the Arrow dataset scanner, which reads the files in\
+            batches and only converts and keeps what was asked for. CSV\
+            files are read like the constructor reads them (the first line\
+            is skipped); .parquet files must have the column names in\
+            COLUMNS, as written by data.dataframe.to_parquet(path), and\
+            row groups outside the filters are skipped without being read.
+            
+            :param paths: file path, or list of file paths read one after another
+            :param list columns: names from COLUMNS to keep; all by default.\
+                The getters need the columns they read.
+            :param tuple time_range: (start_time, end_time) timestamps; like\
+                trim, only readings strictly between them are kept
+            :param tuple altitude_range: (lowest, highest) altitudes in meters\
+                to keep, inclusive
+            :param calibration: see the constructor
+        """
+        import pyarrow.csv
+        import pyarrow.dataset
+        
+        if isinstance(paths, (str, os.PathLike)):
+            paths = [paths]
+        paths = [os.fspath(path) for path in paths]
+        if all(path.endswith('.parquet') for path in paths):
+            file_format = pyarrow.dataset.ParquetFileFormat()
+        else:
+            file_format = pyarrow.dataset.CsvFileFormat(
+                read_options=pyarrow.csv.ReadOptions(column_names=cls.COLUMNS, skip_rows=1),
+                convert_options=pyarrow.csv.ConvertOptions(column_types={name: pyarrow.float64() for name in cls.COLUMNS}))
+        dataset = pyarrow.dataset.dataset(paths, format=file_format)
+        
+        condition = None
+        if (time_range is not None):
+            times = pyarrow.dataset.field('TimeStampUTC (ms)')
+            condition = (times > time_range[0]) & (times < time_range[1])
+        if (altitude_range is not None):
+            altitudes = pyarrow.dataset.field('Altitude (m)')
+            altitude_condition = (altitudes >= altitude_range[0]) & (altitudes <= altitude_range[1])
+            condition = altitude_condition if condition is None else condition & altitude_condition
+        
+        table = dataset.to_table(columns=list(columns) if columns is not None else cls.COLUMNS,
+                                 filter=condition)
+        return cls(table.to_pandas(), calibration)
+    
+    @classmethod
+    def from_BIN(cls, flightNum, start_time = None, end_time = None,
+                 align = False, tolerance = 0.5, max_lag = 30,
+                 export_csv = False, calibration = None):
+        """ Returns a FlightData object decoded, merged, and trimmed straight\
+            from a BIN file without writing or reading the intermediate CSVs
+        
+        :param int flightNum: the flight number in the BIN file.\
+                              Ex) 00000004.BIN -> flightNum = 4
+        :param int start_time: timestamp to start recording values; None keeps\
+            everything from the start of the flight
+        :param int end_time: timestamp to stop recording values; None keeps\
+            everything to the end of the flight
+        :param bool align: join the sensors with merge_sensor_data instead of\
+            the index matching of generate_ALL_CSV; False by default
+        :param double tolerance: see merge_sensor_data; 0.5 default
+        :param double max_lag: see merge_sensor_data; 30 default
+        :param bool export_csv: also write the ALT, CO2, RH_TEMP, ALL, and\
+            (when trimming) ALL_TRIMMED CSV files; False by default
+        :param calibration: see the constructor
+        """
+        name = str(flightNum).zfill(8)
+        sensor_data = cls.read_BIN(flightNum)
+        
+        if (align):
+            ALL_dataframe = cls.merge_sensor_data(sensor_data["ALT"], sensor_data["CO2"],
+                                                  sensor_data["RH_TEMP"], tolerance=tolerance,
+                                                  max_lag=max_lag)
+        else:
+            ALL_dataframe = cls.match_sensor_data(sensor_data["ALT"], sensor_data["CO2"],
+                                                  sensor_data["RH_TEMP"])
+        data = cls(ALL_dataframe, calibration)
+        
+        trimmed = start_time is not None or end_time is not None
+        if (trimmed):
+            data = data.trim(-np.inf if start_time is None else start_time,
+                             np.inf if end_time is None else end_time)
+        
+        if (export_csv):
+            for typeLabel, dataframe in sensor_data.items():
+                dataframe.to_csv(f"{name}{typeLabel}.csv", index=False)
+            ALL_dataframe.to_csv(f"{name}ALL.csv", index=False)
+            if (trimmed):
+                #the trimmed csv has no header, like trim_ALL_CSV
+                data.dataframe.to_csv(f"{name}ALL_TRIMMED.csv", index=False, header=False)
+        
+        return data
+    
+    @staticmethod
+    def read_BIN(flightNum):
+        """ Returns a dictionary with the ALT, CO2, and RH_TEMP dataframes\
+            decoded from a BIN file, with the same columns as the CSV files\
+            from convert_BIN_to_CSV. Requires the pymavlink library.
+        
+        :param int flightNum: the flight number in the BIN file.\
+                              Ex) 00000004.BIN -> flightNum = 4
+        """
+        from pymavlink import mavutil
+        
+        typeNames = {"BAR2": "ALT", "CO2": "CO2", "RHUM": "RH_TEMP"}
+        rows = {typeLabel: [] for typeLabel in typeNames.values()}
+        
+        mlog = mavutil.mavlink_connection(f"{str(flightNum).zfill(8)}.BIN")
+        while True:
+            m = mlog.recv_match(type=list(typeNames))
+            if m is None:
+                break
+            row = m.to_dict()
+            del row['mavpackettype']
+            row['timestamp'] = getattr(m, '_timestamp', 0.0)
+            rows[typeNames[m.get_type()]].append(row)
+        
+        sensor_data = {}
+        for typeLabel, typeRows in rows.items():
+            if not typeRows:
+                raise ValueError(f"No {typeLabel} messages were found in the BIN file")
+            dataframe = pd.DataFrame(typeRows).rename(columns=str.strip)
+            sensor_data[typeLabel] = dataframe[["timestamp"] + [c for c in dataframe.columns if c != "timestamp"]]
+        return sensor_data
+
     @staticmethod
     def convert_BIN_to_CSV(flightNum):
         """ Converts a BIN file to ALT, CO2, and RH CSV files 
@@ -174,11 +444,44 @@ class FlightData():
             print(f"{str(flightNum).zfill(8)}" + typeLabel + ".csv has been generated")
         
     @staticmethod
-    def generate_ALL_CSV(flightNum):
+    def generate_ALL_CSV(flightNum, align = False, tolerance = 0.5, max_lag = 30):
         """ Generates the ALL CSV file from the ALT, CO2, and RH CSV files
 
         :param int flightNum: the flight number in the BIN file.\
                               Ex) 00000004.BIN -> flightNum = 4
+        :param bool align: Estimate and remove the sensor lags and join the\
+            readings by nearest time (see merge_sensor_data) instead of\
+            matching rows by index and whole seconds; False by default
+        :param double tolerance: largest time difference in seconds allowed\
+            when joining readings with align; 0.5 default
+        :param double max_lag: largest sensor lag in seconds searched for\
+            with align; 30 default
+        """
+        ALT_dataframe = pd.read_csv(f'{str(flightNum).zfill(8)}ALT.csv')
+        CO2_dataframe = pd.read_csv(f'{str(flightNum).zfill(8)}CO2.csv')
+        RH_TEMP_dataframe = pd.read_csv(f'{str(flightNum).zfill(8)}RH_TEMP.csv')
+        
+        if (align):
+            ALL_dataframe = FlightData.merge_sensor_data(ALT_dataframe, CO2_dataframe, RH_TEMP_dataframe,
+                                                         tolerance=tolerance, max_lag=max_lag)
+            for sensor, lag in ALL_dataframe.attrs["sensor_lags"].items():
+                print(f"{sensor} lag estimated at {lag:.2f} s")
+        else:
+            ALL_dataframe = FlightData.match_sensor_data(ALT_dataframe, CO2_dataframe, RH_TEMP_dataframe)
+        
+        ALL_dataframe.to_csv(f"{str(flightNum).zfill(8)}ALL.csv", index=False)
+        print(f"ALL csv number {str(flightNum)} has been generated")
+    
+    @staticmethod
+    def match_sensor_data(ALT_dataframe, CO2_dataframe, RH_TEMP_dataframe):
+        """ Returns a dataframe in the layout of the ALL CSV built from the\
+            ALT, CO2, and RH_TEMP dataframes read from the BIN conversion.\
+            CO2 and RH_TEMP rows are matched by index, and the ALT data by\
+            equal whole seconds.
+            
+            :param DataFrame ALT_dataframe: BAR2 data with timestamp, Alt, Press
+            :param DataFrame CO2_dataframe: CO2 data with timestamp, co2Val0, co2Val1
+            :param DataFrame RH_TEMP_dataframe: RHUM data with timestamp, T1-T4, H1-H4
         """
         ALL_dataframe = pd.DataFrame(columns = ["Timestamp",
                                                 "Altitude",
@@ -209,14 +512,10 @@ class FlightData():
         altitude_list = []
         pressure_list = []
         
-        #reading in the data
-        ALT_filename = f'{str(flightNum).zfill(8)}ALT.csv'
-        CO2_filename = f'{str(flightNum).zfill(8)}CO2.csv'
-        RH_TEMP_filename = f'{str(flightNum).zfill(8)}RH_TEMP.csv'
-        
-        ALT_dataframe = pd.read_csv(ALT_filename)
-        CO2_dataframe = pd.read_csv(CO2_filename)
-        RH_TEMP_dataframe = pd.read_csv(RH_TEMP_filename)
+        #the CSV headers from the BIN conversion can have stray spaces
+        ALT_dataframe = ALT_dataframe.rename(columns=str.strip)
+        CO2_dataframe = CO2_dataframe.rename(columns=str.strip)
+        RH_TEMP_dataframe = RH_TEMP_dataframe.rename(columns=str.strip)
         
         #setting up the time matching algorithm
         
@@ -259,10 +558,10 @@ class FlightData():
             
             for index in time_bucket:
                 #this if statement checks for bad sensor readings
-                if (CO2_dataframe["co2Val0"][index] != 0 and CO2_dataframe[" co2Val1"][index] != 0):
+                if (CO2_dataframe["co2Val0"][index] != 0 and CO2_dataframe["co2Val1"][index] != 0):
                     
                     ppm1_temp.append(CO2_dataframe["co2Val0"][index])
-                    ppm2_temp.append(CO2_dataframe[" co2Val1"][index]) #note that this name has a random space in front >:(
+                    ppm2_temp.append(CO2_dataframe["co2Val1"][index])
                     temp1_temp.append(RH_TEMP_dataframe["T1"][index])
                     temp2_temp.append(RH_TEMP_dataframe["T2"][index])
                     temp3_temp.append(RH_TEMP_dataframe["T3"][index])
@@ -342,9 +641,123 @@ class FlightData():
         ALL_dataframe["Altitude"] = altitude_list
         ALL_dataframe["Pressure"] = pressure_list
         
+        return ALL_dataframe
+    
+    @staticmethod
+    def estimate_sensor_lag(reference_times, reference_values, sensor_times,
+                            sensor_values, resolution = 0.1, max_lag = 30):
+        """ Returns the lag in seconds of a sensor behind a reference signal,
+            found from the peak of their FFT cross-correlation. A positive\
+            lag means the sensor responds later than the reference.
             
-        ALL_dataframe.to_csv(f"{str(flightNum).zfill(8)}ALL.csv", index=False)
-        print(f"ALL csv number {str(flightNum)} has been generated")        
+            Both signals are interpolated onto a common grid and differenced\
+            first, so the slow trend of the ascent does not dominate the peak.
+            
+            :param reference_times: timestamps (s) of the reference readings
+            :param reference_values: reference readings (e.g. pressure)
+            :param sensor_times: timestamps (s) of the sensor readings
+            :param sensor_values: sensor readings (e.g. CO2 ppm)
+            :param double resolution: grid spacing in seconds; 0.1 default
+            :param double max_lag: largest lag in seconds searched; 30 default
+        """
+        signals = []
+        for times, values in ((reference_times, reference_values), (sensor_times, sensor_values)):
+            times = np.asarray(times, dtype=float)
+            values = np.asarray(values, dtype=float)
+            finite = np.isfinite(times) & np.isfinite(values)
+            order = np.argsort(times[finite], kind="stable")
+            signals.append((times[finite][order], values[finite][order]))
+        
+        start = max(signals[0][0][0], signals[1][0][0])
+        end = min(signals[0][0][-1], signals[1][0][-1])
+        grid = np.arange(start, end, resolution)
+        if (grid.size < 3):
+            raise ValueError("The reference and sensor readings do not overlap in time")
+        
+        reference, sensor = [np.diff(np.interp(grid, times, values)) for times, values in signals]
+        reference = (reference - reference.mean()) / (reference.std() or 1)
+        sensor = (sensor - sensor.mean()) / (sensor.std() or 1)
+        
+        #circular cross-correlation, zero padded so the lags do not wrap around
+        n = reference.size
+        nfft = 1 << (2 * n - 1).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(sensor, nfft) * np.conj(np.fft.rfft(reference, nfft)), nfft)
+        
+        max_shift = min(int(max_lag / resolution), n - 1)
+        shifts = np.arange(-max_shift, max_shift + 1)
+        best = shifts[np.argmax(np.abs(correlation[shifts]))]
+        return best * resolution
+    
+    @staticmethod
+    def merge_sensor_data(ALT_dataframe, CO2_dataframe, RH_TEMP_dataframe,
+                          align = True, tolerance = 0.5, max_lag = 30,
+                          resolution = 0.1):
+        """ Returns a dataframe in the layout of the ALL CSV built from the\
+            ALT, CO2, and RH_TEMP dataframes read from the BIN conversion.
+            
+            With align, the lag of the CO2 sensors behind the pressure\
+            readings and of the temperature sensors behind the altitude\
+            readings are estimated with estimate_sensor_lag and removed from\
+            their timestamps. Each CO2 reading is then joined to the nearest\
+            RH_TEMP and ALT readings within the tolerance, and the joined\
+            rows are averaged over each second. The lags that were removed\
+            are kept in the dataframe's attrs["sensor_lags"].
+            
+            :param DataFrame ALT_dataframe: BAR2 data with timestamp, Alt, Press
+            :param DataFrame CO2_dataframe: CO2 data with timestamp, co2Val0, co2Val1
+            :param DataFrame RH_TEMP_dataframe: RHUM data with timestamp, T1-T4, H1-H4
+            :param bool align: estimate and remove the sensor lags; True default
+            :param double tolerance: largest time difference in seconds allowed\
+                when joining readings; 0.5 default
+            :param double max_lag: largest sensor lag in seconds searched; 30 default
+            :param double resolution: grid spacing in seconds used for the lag\
+                estimate; 0.1 default
+        """
+        #the CSV headers from the BIN conversion can have stray spaces
+        ALT = ALT_dataframe.rename(columns=str.strip)[["timestamp", "Alt", "Press"]]
+        CO2 = CO2_dataframe.rename(columns=str.strip)[["timestamp", "co2Val0", "co2Val1"]]
+        RH_TEMP = RH_TEMP_dataframe.rename(columns=str.strip)[["timestamp", "T1", "T2", "T3", "T4",
+                                                              "H1", "H2", "H3", "H4"]]
+        
+        #dropping bad sensor readings
+        CO2 = CO2[(CO2["co2Val0"] != 0) & (CO2["co2Val1"] != 0)]
+        
+        lags = {"CO2": 0.0, "RH_TEMP": 0.0}
+        if (align):
+            lags["CO2"] = FlightData.estimate_sensor_lag(
+                ALT["timestamp"], ALT["Press"], CO2["timestamp"],
+                (CO2["co2Val0"] + CO2["co2Val1"]) / 2, resolution, max_lag)
+            lags["RH_TEMP"] = FlightData.estimate_sensor_lag(
+                ALT["timestamp"], ALT["Alt"], RH_TEMP["timestamp"],
+                (RH_TEMP["T2"] + RH_TEMP["T3"] + RH_TEMP["T4"]) / 3, resolution, max_lag)
+        
+        CO2 = CO2.assign(timestamp=CO2["timestamp"] - lags["CO2"]).sort_values("timestamp")
+        RH_TEMP = RH_TEMP.assign(timestamp=RH_TEMP["timestamp"] - lags["RH_TEMP"]).sort_values("timestamp")
+        ALT = ALT.sort_values("timestamp")
+        
+        merged = pd.merge_asof(CO2, RH_TEMP, on="timestamp", direction="nearest", tolerance=tolerance)
+        merged = pd.merge_asof(merged, ALT, on="timestamp", direction="nearest", tolerance=tolerance)
+        merged = merged.dropna()
+        
+        #averaging over each second like generate_ALL_CSV
+        merged["timestamp"] = merged["timestamp"].round().astype(np.int64)
+        merged = merged.groupby("timestamp", sort=True).mean().reset_index()
+        
+        ALL_dataframe = pd.DataFrame({"Timestamp": merged["timestamp"],
+                                      "Altitude": merged["Alt"],
+                                      "Pressure": merged["Press"],
+                                      "CO2 ppm 1": merged["co2Val0"],
+                                      "CO2 ppm 2": merged["co2Val1"],
+                                      "Temperature 1": merged["T1"],
+                                      "Temperature 2": merged["T2"],
+                                      "Temperature 3": merged["T3"],
+                                      "Temperature 4": merged["T4"],
+                                      "Humidity 1": merged["H1"],
+                                      "Humidity 2": merged["H2"],
+                                      "Humidity 3": merged["H3"],
+                                      "Humidity 4": merged["H4"]})
+        ALL_dataframe.attrs["sensor_lags"] = lags
+        return ALL_dataframe
     
     @staticmethod
     def trimArduPlaneCSV(base_filename, fixed_filename, start_time, end_time):
@@ -379,17 +792,56 @@ class FlightData():
         trimmed_filename = f"{str(flightNum).zfill(8)}ALL_TRIMMED.csv"
         FlightData.trimArduPlaneCSV(base_filename, trimmed_filename, start_time, end_time)
         
+def _load_concurrently(load, items, max_workers, use_processes):
+    """ Yields load(item) for every item as soon as each one finishes,
+    running at most max_workers loads at a time in a thread or process pool
+    and keeping at most twice that many unconsumed results
+    """
+    pool_type = concurrent.futures.ProcessPoolExecutor if use_processes else concurrent.futures.ThreadPoolExecutor
+    items = iter(items)
+    pool = pool_type(max_workers=max_workers)
+    try:
+        pending = {pool.submit(load, item) for item in itertools.islice(items, 2 * max_workers)}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                pending.update(pool.submit(load, item) for item in itertools.islice(items, 1))
+    finally:
+        #stop any loads that have not started if the caller stops early
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def _read_only(values, dtype = None):
+    """ Returns values as a numpy array that cannot be written to
+    """
+    array = np.array(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
 class Profile():
     """ A Profile object takes data from a FlightData object and processes it, 
     namely applying a pressure correction and averaging sensor data at 
-    discrete steps.  
+    discrete steps. The results are kept in read-only numpy arrays, and the
+    getters return read-only views of them rather than copies.
     
     :var str TIME_FORMAT: Format for start time
+    :var double REGRESSION_SLOPE: slope of the pressure chamber regression,\
+        used when there is no calibration table
+    :var double REGRESSION_INTERCEPT: intercept of the pressure chamber\
+        regression, used when there is no calibration table
+    :var int CACHE_VERSION: version of the cached Profile files; bump it when\
+        the processing changes so old cache files are recomputed
     """
     
     TIME_FORMAT = "%H:%M:%S"
+    REGRESSION_SLOPE = 0.46698
+    REGRESSION_INTERCEPT = -1.5188
+    CACHE_VERSION = 2
     
-    def __init__(self, flightNum, correction="Linear", userHeightInput = False):
+    def __init__(self, flightNum, correction="Linear", userHeightInput = False,
+                 bootstrap_resamples = 0, bootstrap_block_size = 1,
+                 confidence = 0.95, seed = None, derived = (), data = None,
+                 heights = None, calibration = None):
         """ Creates a Profile object.
         
         :param int flightNum: the flight number in the BIN file.\
@@ -398,19 +850,36 @@ class Profile():
         :param bool userHeightInput: Controls whether the user supplies every\ 
             altitude step (True), or if the user supplies only starting\
                 altitude and timestep.
+        :param int bootstrap_resamples: Number of bootstrap resamples used for\
+            the confidence intervals at each height; 0 (default) skips them.
+        :param int bootstrap_block_size: Length of the blocks used by the\
+            moving block bootstrap; 1 (default) is the ordinary bootstrap.
+        :param double confidence: Confidence level of the intervals; 0.95 default
+        :param int seed: Seed for the bootstrap random number generator
+        :param list derived: Names of derived quantities (see\
+            FlightData.DERIVED_QUANTITIES) to average at each height
+        :param FlightData data: Trimmed flight data to use instead of reading\
+            the flight's ALL_TRIMMED csv
+        :param heights: Heights to average around, as a list or a grid\
+            specification (see height_grid); when given, the user is not\
+            prompted for heights
+        :param calibration: Calibration for reading the ALL_TRIMMED csv (see\
+            FlightData); data passed in keeps its own calibration
         """
         
         self.flightNum = flightNum
         
-        #reading in a trimmed ALL csv
-        trimmedFilePath = f"{str(flightNum).zfill(8)}ALL_TRIMMED.csv"
-        data = FlightData(trimmedFilePath)
+        #reading in a trimmed ALL csv unless the data was passed in
+        if (data is None):
+            trimmedFilePath = f"{str(flightNum).zfill(8)}ALL_TRIMMED.csv"
+            data = FlightData(trimmedFilePath, calibration)
         
-        #assigning data lists with columns from the dataframe
-        self.altitude_list = data.get_altitudes()
-        self.avg_ppm_list = data.get_avgCO2_with_Offset()
-        temp_list = data.get_temperatures()
-        pressure_list = data.get_pressures()
+        #assigning data arrays with columns from the dataframe
+        altitudes = np.array(data.get_altitudes())
+        ppms = np.array(data.get_avgCO2_with_Offset())
+        temps = np.array(data.get_temperatures())
+        pressures = np.array(data.get_pressures())
+        derived_columns = data.get_derived(derived)
         
         #setting the start time of the flight
         start_time_datetime = data.get_UTC_times()[0]
@@ -427,7 +896,9 @@ class Profile():
         
         print(f"\nYou are visualizing flight {str(flightNum)} \n")
         #creating the list of heights
-        if(userHeightInput):
+        if(heights is not None):
+            self.heights = Profile.height_grid(heights, altitudes)
+        elif(userHeightInput):
             prompt1 = "Please enter a height to add to the height list. "
             prompt2 = "To remove the last input, enter 'oops' and to finish, enter 'q'\n"
             userInput = input(prompt1 + prompt2)
@@ -503,42 +974,234 @@ class Profile():
                 
         #parsing the ppms
         if(self.useLinearRegression == True):
-            initial_pressure = pressure_list[0]
-            offset = self.avg_ppm_list[0] - Profile.lRegression(initial_pressure, 0)
+            initial_pressure = pressures[0]
+            slope, intercept = data.regression_slope, data.regression_intercept
+            offset = ppms[0] - Profile.lRegression(initial_pressure, 0, slope, intercept)
             
-            pivot = Profile.lRegression(initial_pressure, offset)
-            self.avg_ppm_list = [ppm + (pivot - Profile.lRegression(pressure, offset)) for ppm, pressure in zip(self.avg_ppm_list, pressure_list)]
+            pivot = Profile.lRegression(initial_pressure, offset, slope, intercept)
+            ppms = ppms + (pivot - Profile.lRegression(pressures, offset, slope, intercept))
         
         elif(self.useLiCorrection == True):
-            self.avg_ppm_list = [Profile.li_correction(c, T, p) for c, T, p in zip(self.avg_ppm_list, temp_list, pressure_list)]
-        
-        ppms_at_height = {}
-        temps_at_height = {}
-        for height in self.heights:
-            ppms_at_height[f'ppms_at{str(height)}'] = []
-            temps_at_height[f'temps_at_{str(height)}'] = [] 
-  
-        for ppm, altitude, temp in zip(self.avg_ppm_list, self.altitude_list, temp_list):
-            for height in self.heights:
-                if altitude > height-10 and altitude < height+10:
-                    ppms_at_height[f'ppms_at{str(height)}'].append(ppm)
-                    temps_at_height[f'temps_at_{str(height)}'].append(temp)
-        
-        avg_ppm_at_height = []
-        ppm_at_height_stdev = []
-        avg_temp_at_height = []
-        temp_at_height_stdev = []
-        
-        for height in self.heights:
-            avg_ppm_at_height.append(sum(ppms_at_height[f'ppms_at{str(height)}'])/len(ppms_at_height[f'ppms_at{str(height)}']))
-            ppm_at_height_stdev.append(statistics.stdev(ppms_at_height[f'ppms_at{str(height)}']))
-            avg_temp_at_height.append(sum(temps_at_height[f'temps_at_{str(height)}'])/len(temps_at_height[f'temps_at_{str(height)}']))
-            temp_at_height_stdev.append(statistics.stdev(temps_at_height[f'temps_at_{str(height)}']))
-        
-        self.avg_ppm_at_height = avg_ppm_at_height
-        self.ppm_at_height_stdev = ppm_at_height_stdev
-        self.avg_temp_at_height = avg_temp_at_height
-        self.temp_at_height_stdev = temp_at_height_stdev
+            ppms = Profile.li_correction(ppms, temps, pressures)
+        
+        self.altitude_list = _read_only(altitudes)
+        self.avg_ppm_list = _read_only(ppms)
+        self.temp_list = _read_only(temps)
+        self.heights = _read_only(self.heights)
+        
+        #finding the readings within 10 m of each height
+        height_bins = [np.flatnonzero((altitudes > height-10) & (altitudes < height+10)) for height in self.heights]
+        
+        self.avg_ppm_at_height, self.ppm_at_height_stdev = self.bin_statistics(ppms, height_bins, self.heights)
+        self.avg_temp_at_height, self.temp_at_height_stdev = self.bin_statistics(temps, height_bins, self.heights)
+        self.count_at_height = _read_only([height_bin.size for height_bin in height_bins], np.int64)
+        
+        self.avg_derived_at_height = {}
+        self.derived_stdev_at_height = {}
+        for name, values in derived_columns.items():
+            self.avg_derived_at_height[name], self.derived_stdev_at_height[name] = self.bin_statistics(values, height_bins, self.heights)
+        
+        #bootstrap confidence intervals, resampled for all heights at once
+        self.ppm_ci_at_height = None
+        self.temp_ci_at_height = None
+        if (bootstrap_resamples > 0):
+            rng = np.random.default_rng(seed)
+            self.ppm_ci_at_height = Profile.bootstrap_ci(
+                [ppms[height_bin] for height_bin in height_bins],
+                bootstrap_resamples, bootstrap_block_size, confidence, rng)
+            self.temp_ci_at_height = Profile.bootstrap_ci(
+                [temps[height_bin] for height_bin in height_bins],
+                bootstrap_resamples, bootstrap_block_size, confidence, rng)
+    
+    @classmethod
+    def from_arrays(cls, flightNum, timestamps, altitudes, pressures, CO2_1,
+                    CO2_2, temperatures, humidities, **kwargs):
+        """ Creates a Profile object from arrays of readings instead of a
+        csv file; see FlightData.from_arrays for the arrays. Any other
+        keyword arguments are passed to the constructor.
+        
+        :param int flightNum: the flight number, used as a label
+        """
+        data = FlightData.from_arrays(timestamps, altitudes, pressures, CO2_1,
+                                      CO2_2, temperatures, humidities,
+                                      kwargs.pop("calibration", None))
+        return cls(flightNum, data=data, **kwargs)
+    
+    @classmethod
+    def load_many(cls, flightNums, max_workers = 8, use_processes = False,
+                  cached = False, **kwargs):
+        """ Yields a Profile for each flight as soon as it is ready, reading
+        and processing several flights at a time. The Profiles come out in
+        the order they finish, and can be passed straight to plot_profile or
+        plot_scatter_profile so plotting starts before every flight is read.
+        Pass heights, since the workers cannot prompt for them.
+        
+        :param list flightNums: flight numbers of the ALL_TRIMMED csv files
+        :param int max_workers: flights processed at the same time; 8 default
+        :param bool use_processes: use a process pool instead of threads
+        :param bool cached: use Profile.cached instead of the constructor
+        
+        Any other keyword arguments are passed to the constructor.
+        """
+        if (kwargs.get("heights") is None):
+            raise ValueError("Profile.load_many needs heights, since the workers cannot prompt for them")
+        load = cls.cached if cached else cls
+        return _load_concurrently(functools.partial(load, **kwargs), flightNums,
+                                      max_workers, use_processes)
+    
+    @classmethod
+    def cached(cls, flightNum, cache_dir = "profile_cache", data = None, **kwargs):
+        """ Returns a Profile loaded from the cache if it was computed before
+        from the same data and parameters, and otherwise creates the Profile
+        and saves it to the cache. The cache key is a hash of the data, the
+        keyword arguments, and the calibration in use (or the sensor offsets
+        and regression coefficients without one), so a Profile is recomputed
+        whenever any of them changes. The heights must be passed in as a
+        keyword argument so that they are part of the key.
+        
+        :param int flightNum: the flight number in the BIN file.\
+                              Ex) 00000004.BIN -> flightNum = 4
+        :param str cache_dir: directory holding the cache files;\
+            "profile_cache" default
+        :param FlightData data: Trimmed flight data to use instead of reading\
+            the flight's ALL_TRIMMED csv
+        """
+        if (kwargs.get("heights") is None):
+            raise ValueError("Profile.cached needs heights; prompted heights cannot be part of the cache key")
+        
+        hasher = hashlib.sha256()
+        if (data is None):
+            with open(f"{str(flightNum).zfill(8)}ALL_TRIMMED.csv", 'rb') as read_file:
+                for chunk in iter(lambda: read_file.read(1 << 20), b''):
+                    hasher.update(chunk)
+        else:
+            hasher.update(pd.util.hash_pandas_object(data.dataframe, index=False).to_numpy().tobytes())
+        
+        parameters = dict(kwargs)
+        for name in ("heights", "derived"):
+            if parameters.get(name) is not None and not isinstance(parameters[name], dict):
+                parameters[name] = list(parameters[name])
+        parameters.update(flightNum=flightNum,
+                          cache_version=cls.CACHE_VERSION,
+                          CO2_sensor1_offset=FlightData.CO2_sensor1_offset,
+                          CO2_sensor2_offset=FlightData.CO2_sensor2_offset,
+                          regression_slope=cls.REGRESSION_SLOPE,
+                          regression_intercept=cls.REGRESSION_INTERCEPT,
+                          calibration=data.calibration if data is not None
+                                      else Calibration.resolve(kwargs.get("calibration")))
+        hasher.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        
+        path = os.path.join(cache_dir, f"{str(flightNum).zfill(8)}_{hasher.hexdigest()[:20]}.npz")
+        if os.path.exists(path):
+            return cls.load(path)
+        
+        profile = cls(flightNum, data=data, **kwargs)
+        os.makedirs(cache_dir, exist_ok=True)
+        profile.save(path, parameters)
+        profile.parameters = parameters
+        return profile
+    
+    def save(self, path, parameters = None):
+        """ Saves the Profile's results to a NumPy .npz file that Profile.load
+        reads back.
+        
+        :param str path: file path to write
+        :param dict parameters: parameters the Profile was created with, kept\
+            in the file for reference
+        """
+        arrays = {"flightNum": np.array(str(self.flightNum)),
+                  "start_time": np.array(self.start_time),
+                  "correction": np.array([self.useLinearRegression, self.useLiCorrection]),
+                  "parameters": np.array(json.dumps(parameters or {}, sort_keys=True, default=str)),
+                  "heights": np.asarray(self.heights),
+                  "avg_ppm_at_height": np.asarray(self.avg_ppm_at_height),
+                  "ppm_at_height_stdev": np.asarray(self.ppm_at_height_stdev),
+                  "avg_temp_at_height": np.asarray(self.avg_temp_at_height),
+                  "temp_at_height_stdev": np.asarray(self.temp_at_height_stdev),
+                  "count_at_height": np.asarray(self.count_at_height),
+                  "avg_ppm_list": np.asarray(self.avg_ppm_list),
+                  "altitude_list": np.asarray(self.altitude_list),
+                  "temp_list": np.asarray(self.temp_list)}
+        if (self.ppm_ci_at_height is not None):
+            arrays["ppm_ci_at_height"] = np.asarray(self.ppm_ci_at_height)
+            arrays["temp_ci_at_height"] = np.asarray(self.temp_ci_at_height)
+        for name in self.avg_derived_at_height:
+            arrays[f"avg_derived_at_height:{name}"] = np.asarray(self.avg_derived_at_height[name])
+            arrays[f"derived_stdev_at_height:{name}"] = np.asarray(self.derived_stdev_at_height[name])
+        
+        #writing to a temporary file first so a crash never leaves half a file;
+        #every writer gets its own so concurrent saves of one key do not collide
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, 'wb') as write_file:
+                np.savez(write_file, **arrays)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+    
+    @classmethod
+    def load(cls, path):
+        """ Returns a Profile read from a file written by Profile.save
+        
+        :param str path: file path to read
+        """
+        profile = cls.__new__(cls)
+        with np.load(path, allow_pickle=False) as arrays:
+            flightNum = str(arrays["flightNum"])
+            profile.flightNum = int(flightNum) if flightNum.isdigit() else flightNum
+            profile.start_time = str(arrays["start_time"])
+            profile.useLinearRegression, profile.useLiCorrection = arrays["correction"].tolist()
+            profile.parameters = json.loads(str(arrays["parameters"]))
+            for name in ("heights", "avg_ppm_at_height", "ppm_at_height_stdev",
+                         "avg_temp_at_height", "temp_at_height_stdev",
+                         "count_at_height", "avg_ppm_list", "altitude_list",
+                         "temp_list"):
+                setattr(profile, name, _read_only(arrays[name]))
+            
+            profile.ppm_ci_at_height = None
+            profile.temp_ci_at_height = None
+            if ("ppm_ci_at_height" in arrays):
+                profile.ppm_ci_at_height = tuple(_read_only(bounds) for bounds in arrays["ppm_ci_at_height"])
+                profile.temp_ci_at_height = tuple(_read_only(bounds) for bounds in arrays["temp_ci_at_height"])
+            
+            profile.avg_derived_at_height = {}
+            profile.derived_stdev_at_height = {}
+            for key in arrays.files:
+                if key.startswith("avg_derived_at_height:"):
+                    name = key.split(":", 1)[1]
+                    profile.avg_derived_at_height[name] = _read_only(arrays[key])
+                    profile.derived_stdev_at_height[name] = _read_only(arrays[f"derived_stdev_at_height:{name}"])
+        return profile
+    
+    def __setstate__(self, state):
+        """ Restores a pickled Profile, e.g. one sent back from a worker
+        process by Profile.load_many. Pickling does not keep arrays
+        read-only, so the results are made read-only again.
+        
+        :param dict state: the Profile's attributes
+        """
+        self.__dict__.update(state)
+        for name in ("heights", "avg_ppm_at_height", "ppm_at_height_stdev",
+                     "avg_temp_at_height", "temp_at_height_stdev",
+                     "count_at_height", "avg_ppm_list", "altitude_list",
+                     "temp_list"):
+            if (name in state):
+                setattr(self, name, _read_only(state[name]))
+        
+        for name in ("ppm_ci_at_height", "temp_ci_at_height"):
+            if (state.get(name) is not None):
+                setattr(self, name, tuple(_read_only(bounds) for bounds in state[name]))
+        
+        for name in ("avg_derived_at_height", "derived_stdev_at_height"):
+            if (name in state):
+                setattr(self, name, {key: _read_only(values) for key, values in state[name].items()})
+    
+    def get_counts_at_heights(self):
+        """ Returns a read-only array of the number of readings averaged at each
+        altitude step
+        """
+        return self.count_at_height.view()
     
     def get_start_time(self):
         """ Returns a string containing the flight's start time in the format 
@@ -558,49 +1221,291 @@ class Profile():
             return "None"
         
     def get_heights(self):
-        """ Returns a list of the altitudes at which the sensor readings have
-        been averaged around.
+        """ Returns a read-only array of the altitudes at which the sensor
+        readings have been averaged around.
         """
-        heights = self.heights[:]
+        heights = self.heights.view()
         return heights
     
     def get_corrected_ppm_values(self):
         """
-        Returns a list containing corrected ppm values using the Profile's correction
+        Returns a read-only array containing corrected ppm values using the
+        Profile's correction
         """
         
-        corrected_ppms = self.avg_ppm_list[:]
+        corrected_ppms = self.avg_ppm_list.view()
         return corrected_ppms
     
     def get_avg_ppm_at_heights(self):
-        """ Returns a list of the average ppm readings for each altitude step
+        """ Returns a read-only array of the average ppm readings for each altitude step
         """
-        avg_ppm_at_heights = self.avg_ppm_at_height[:]
+        avg_ppm_at_heights = self.avg_ppm_at_height.view()
         return avg_ppm_at_heights
     
     def get_ppm_stdev_at_heights(self):
-        """ Returns a list of the standard deviations for the CO2 readings at
+        """ Returns a read-only array of the standard deviations for the CO2 readings at
         each altitude step
         """
-        ppm_at_height_stdev = self.ppm_at_height_stdev[:]
+        ppm_at_height_stdev = self.ppm_at_height_stdev.view()
         return ppm_at_height_stdev
     
     def get_avg_temp_at_heights(self):
-        """ Returns a list of the average temperature readings for each 
+        """ Returns a read-only array of the average temperature readings for each 
         altitude step
         """
-        avg_temp_at_height = self.avg_temp_at_height[:]
+        avg_temp_at_height = self.avg_temp_at_height.view()
         return avg_temp_at_height
     
     def get_temp_stdev_at_heights(self):
-        """ Returns a list of the standard deviations for the temperature 
+        """ Returns a read-only array of the standard deviations for the temperature 
         readings at each altitude step
         """        
-        temp_at_height_stdev = self.temp_at_height_stdev[:]
+        temp_at_height_stdev = self.temp_at_height_stdev.view()
         return temp_at_height_stdev   
+    
+    def get_avg_derived_at_heights(self, name):
+        """ Returns a read-only array of the average of a derived quantity for each
+        altitude step
+        
+        :param str name: name of a derived quantity the Profile was created with
+        """
+        return self.avg_derived_at_height[name].view()
+    
+    def get_derived_stdev_at_heights(self, name):
+        """ Returns a read-only array of the standard deviations of a derived quantity
+        at each altitude step
+        
+        :param str name: name of a derived quantity the Profile was created with
+        """
+        return self.derived_stdev_at_height[name].view()
+    
+    def get_ppm_ci_at_heights(self):
+        """ Returns two read-only arrays -- lower, upper -- with the bootstrap confidence
+        interval of the average ppm reading at each altitude step, or None if
+        the Profile was created without bootstrap resamples
+        """
+        if (self.ppm_ci_at_height is None):
+            return None
+        lower, upper = self.ppm_ci_at_height
+        return lower.view(), upper.view()
+    
+    def get_temp_ci_at_heights(self):
+        """ Returns two read-only arrays -- lower, upper -- with the bootstrap confidence
+        interval of the average temperature at each altitude step, or None if
+        the Profile was created without bootstrap resamples
+        """
+        if (self.temp_ci_at_height is None):
+            return None
+        lower, upper = self.temp_ci_at_height
+        return lower.view(), upper.view()
+    
+    def get_smoothed_profile(self, resolution = 1.0, bandwidth = 10.0,
+                             kernel = "gaussian", min_weight = 1.0):
+        """ Returns three numpy arrays -- altitudes, ppms, temps -- with the
+        corrected CO2 readings and temperatures smoothed over altitude onto
+        a regular grid of altitudes (see Profile.kernel_smooth).
+        
+        :param double resolution: spacing of the altitude grid in meters; 1 default
+        :param double bandwidth: kernel bandwidth in meters; 10 default
+        :param str kernel: "gaussian" (default) or "boxcar"
+        :param double min_weight: grid points with less total kernel weight\
+            than this are set to NaN; 1 default
+        """
+        altitudes = np.asarray(self.altitude_list)
+        grid = np.arange(np.floor(altitudes.min()), np.ceil(altitudes.max()) + resolution, resolution)
+        ppms = Profile.kernel_smooth(altitudes, self.avg_ppm_list, grid, bandwidth, kernel, min_weight, resolution)
+        temps = Profile.kernel_smooth(altitudes, self.temp_list, grid, bandwidth, kernel, min_weight, resolution)
+        return grid, ppms, temps
+    
+    @staticmethod
+    def kernel_smooth(altitudes, values, grid, bandwidth = 10.0,
+                      kernel = "gaussian", min_weight = 1.0, resolution = None):
+        """ Returns a numpy array with the kernel-weighted average of the
+        values at each altitude of a regular grid.
+        
+        The "boxcar" kernel averages every reading strictly within bandwidth
+        meters of a grid altitude, like the height steps of the constructor,
+        using cumulative sums over the altitude-sorted readings. The
+        "gaussian" kernel (bandwidth is its standard deviation) spreads the
+        readings onto the grid by linear binning and convolves them with the
+        kernel using the FFT. Either way the cost is about one sort of the
+        readings plus a pass over the grid.
+        
+        :param altitudes: altitude of each reading
+        :param values: the readings
+        :param grid: evenly spaced, increasing altitudes to estimate at
+        :param double bandwidth: kernel bandwidth in meters; 10 default
+        :param str kernel: "gaussian" (default) or "boxcar"
+        :param double min_weight: grid points with less total kernel weight\
+            (the number of readings, for the boxcar) than this are set to NaN;\
+            1 default
+        :param double resolution: spacing of the grid in meters, needed by\
+            the gaussian kernel; taken from the grid by default
+        """
+        altitudes = np.asarray(altitudes, dtype=float)
+        values = np.asarray(values, dtype=float)
+        grid = np.asarray(grid, dtype=float)
+        
+        if (kernel == "boxcar"):
+            order = np.argsort(altitudes)
+            sorted_altitudes = altitudes[order]
+            cumulative = np.concatenate(([0.0], np.cumsum(values[order])))
+            lower = np.searchsorted(sorted_altitudes, grid - bandwidth, side="right")
+            upper = np.searchsorted(sorted_altitudes, grid + bandwidth, side="left")
+            weights = (upper - lower).astype(float)
+            sums = cumulative[upper] - cumulative[lower]
+        
+        elif (kernel == "gaussian"):
+            #linear binning onto the grid, padded by four bandwidths on both sides
+            if (resolution is None):
+                if (grid.size < 2):
+                    raise ValueError("The grid spacing cannot be found from a one-point grid; pass resolution")
+                resolution = grid[1] - grid[0]
+            pad = int(np.ceil(4 * bandwidth / resolution))
+            size = grid.size + 2 * pad
+            position = (altitudes - grid[0]) / resolution + pad
+            inside = (position >= 0) & (position <= size - 1)
+            position = position[inside]
+            left = np.minimum(np.floor(position).astype(np.intp), size - 2)
+            fraction = position - left
+            binned_weights = (np.bincount(left, 1 - fraction, size) +
+                              np.bincount(left + 1, fraction, size))
+            binned_sums = (np.bincount(left, values[inside] * (1 - fraction), size) +
+                           np.bincount(left + 1, values[inside] * fraction, size))
+            
+            offsets = np.arange(-pad, pad + 1) * resolution
+            kernel_weights = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+            nfft = 1 << (size + kernel_weights.size - 1).bit_length()
+            kernel_fft = np.fft.rfft(kernel_weights, nfft)
+            weights, sums = [np.fft.irfft(np.fft.rfft(binned, nfft) * kernel_fft, nfft)[2 * pad:2 * pad + grid.size]
+                             for binned in (binned_weights, binned_sums)]
+        
+        else:
+            raise ValueError(f"Unknown kernel {kernel}; choose \"gaussian\" or \"boxcar\"")
+        
+        smoothed = np.full(grid.size, np.nan)
+        enough = weights >= min_weight
+        smoothed[enough] = sums[enough] / weights[enough]
+        return smoothed
+    
+    @staticmethod
+    def height_grid(spec, altitudes = None):
+        """ Returns the list of heights described by a grid specification,
+        the programmatic version of the height prompts.
+        
+        A list (or array) of heights is used as it is. A dictionary with
+        start, step, and stop gives the regular steps start, start + step,
+        ... below stop, with an optional lowest height in front, like the
+        prompts without userHeightInput. A dictionary with quantiles gives
+        the altitude quantiles of the readings rounded to whole meters,
+        either at the listed fractions or, for a number n, at n evenly
+        spaced fractions strictly between 0 and 1.
+        
+        Ex) {"lowest": 35, "start": 50, "step": 20, "stop": 380}\n
+        Ex) {"quantiles": [0.1, 0.5, 0.9]} or {"quantiles": 10}
+        
+        :param spec: list of heights or dictionary as above
+        :param altitudes: altitudes of the readings, needed for quantiles
+        """
+        if not isinstance(spec, dict):
+            return list(spec)
+        
+        if ("quantiles" in spec):
+            if (altitudes is None):
+                raise ValueError("Quantile heights need the altitudes of the readings")
+            quantiles = spec["quantiles"]
+            if isinstance(quantiles, int):
+                quantiles = np.arange(1, quantiles + 1) / (quantiles + 1)
+            return np.unique(np.round(np.quantile(altitudes, quantiles))).astype(int).tolist()
+        
+        if not {"start", "step", "stop"} <= set(spec):
+            raise ValueError(f"A height grid needs either quantiles or start, step, and stop; got {spec}")
+        if (spec["step"] <= 0):
+            raise ValueError("The height step must be positive")
+        heights = [] if spec.get("lowest") is None else [spec["lowest"]]
+        height = spec["start"]
+        while height < spec["stop"]:
+            heights.append(height)
+            height += spec["step"]
+        return heights
+    
+    @staticmethod
+    def bin_statistics(values, height_bins, heights):
+        """ Returns two read-only numpy arrays -- means, stdevs -- of the
+        values in each height bin
+        
+        :param values: numpy array of readings
+        :param list height_bins: One array of reading indices per height
+        :param list heights: The heights of the bins, for error messages
+        """
+        means = np.empty(len(height_bins))
+        stdevs = np.empty(len(height_bins))
+        for i, (height, height_bin) in enumerate(zip(heights, height_bins)):
+            if (height_bin.size < 2):
+                raise ValueError(f"Fewer than two readings within 10 m of {height} m")
+            means[i] = values[height_bin].mean()
+            stdevs[i] = values[height_bin].std(ddof=1)
+        return _read_only(means), _read_only(stdevs)
+    
+    @staticmethod
+    def bootstrap_ci(samples, n_resamples = 2000, block_size = 1,
+                     confidence = 0.95, seed = None, batch_size = 256):
+        """ Returns two read-only numpy arrays -- lower, upper -- with
+        percentile bootstrap confidence intervals for the mean of each group
+        of samples.
+        
+        Every group is resampled in the same batch of array operations, so
+        the cost does not grow with a Python loop over heights. A block_size
+        larger than 1 uses the moving block bootstrap, which keeps runs of
+        consecutive (autocorrelated) readings together. At a height with too
+        few readings for the block length, the blocks are shortened to half
+        the number of readings there, so every height still has at least two
+        blocks to resample.
+        
+        :param list samples: One sequence of time-ordered readings per height
+        :param int n_resamples: Number of bootstrap resamples; 2000 default
+        :param int block_size: Moving block length of at least 1; 1 default
+        :param double confidence: Confidence level; 0.95 default
+        :param seed: Seed or numpy Generator for the resampling
+        :param int batch_size: Resamples drawn per batch, bounding memory use
+        """
+        if (block_size < 1):
+            raise ValueError(f"The bootstrap block size must be at least 1, not {block_size}")
+        if (n_resamples < 1):
+            raise ValueError(f"The number of bootstrap resamples must be at least 1, not {n_resamples}")
+        if (len(samples) == 0):
+            raise ValueError("There are no heights to bootstrap")
+        
+        rng = np.random.default_rng(seed)
+        counts = np.array([len(group) for group in samples], dtype=np.intp)
+        if (counts.min() < 2):
+            raise ValueError("Every height needs at least two readings to bootstrap")
+        values = np.concatenate([np.asarray(group, dtype=float) for group in samples])
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        
+        #every height is cut into at least two blocks; a reading belongs to one block
+        blocks = np.minimum(int(block_size), np.maximum(1, counts // 2))
+        n_blocks = -(-counts // blocks)
+        block_starts = np.concatenate(([0], np.cumsum(n_blocks)[:-1]))
+        group_of_value = np.repeat(np.arange(counts.size), counts)
+        position = np.arange(values.size) - starts[group_of_value]
+        block_of_value = block_starts[group_of_value] + position // blocks[group_of_value]
+        offset_in_block = position % blocks[group_of_value] + starts[group_of_value]
+        block_choices = (counts - blocks + 1)[np.repeat(np.arange(counts.size), n_blocks)]
+        
+        means = np.empty((n_resamples, counts.size))
+        for first in range(0, n_resamples, batch_size):
+            n = min(batch_size, n_resamples - first)
+            block_offsets = (rng.random((n, block_choices.size)) * block_choices).astype(np.intp)
+            resampled = values[block_offsets[:, block_of_value] + offset_in_block]
+            means[first:first + n] = np.add.reduceat(resampled, starts, axis=1) / counts
+        
+        alpha = (1 - confidence) / 2
+        lower, upper = np.quantile(means, [alpha, 1 - alpha], axis=0)
+        return _read_only(lower), _read_only(upper)
 
     @staticmethod
-    def lRegression(pressure, offset): #avg of the 3 linear regressions from the chamber
+    def lRegression(pressure, offset, slope = None, intercept = None): #avg of the 3 linear regressions from the chamber
         """ Returns an expected CO2 reading based on the
         linear regression developed in the pressure chamber
         experiment.
@@ -609,9 +1514,14 @@ class Profile():
         :param double offset: Difference between the first \ 
         averaged CO2 value and the regression with no offset \
         (refer to constructor code for implementation)         
+        :param double slope: regression slope; REGRESSION_SLOPE by default
+        :param double intercept: regression intercept; REGRESSION_INTERCEPT\
+        by default
         """
-        slope = 0.46698
-        intercept = -1.5188
+        if (slope is None):
+            slope = Profile.REGRESSION_SLOPE
+        if (intercept is None):
+            intercept = Profile.REGRESSION_INTERCEPT
         ppm = slope * pressure + intercept + offset
         return ppm
 
@@ -623,70 +1533,149 @@ class Profile():
         return c * (1013*(T)/((25+273)*p))        
 
     @staticmethod
-    def plot_profile(flights, profile_type = "CO2", width = 7,
-                     height = 10, xlabel_size = 14, ylabel_size = 14,
-                     capsize = 6, marker = "D"):
-        """ Creates a plot of the profile for a flight day.
-        
-        :param list<Profile> flights: List of Profile objects\n
-        :param str profile_type: String containing the name of
-        the parameter to be plotted (default "CO2," or "Temp").\n
-        :param int width: width of the plot in inches; 7 default\n
-        :param int height: height of the plot in inches; 10 default\n
-        :param int xlabel_size: xlabel fontsize; 14 default\n
-        :param int ylabel_size: ylabel fontsize; 14 default\n
-        """
-        if profile_type == "CO2":
-            fig, axs = plt.subplots(figsize=(width,height))
-            for flight in flights:
-                axs.errorbar(flight.avg_ppm_at_height, flight.heights, 
-                     xerr=flight.ppm_at_height_stdev, capsize=capsize, marker=marker, 
-                     label=f'Starting at {flight.start_time}')
-                
-            axs.set_xlabel('CO2 ppm', fontsize=xlabel_size)
-            axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
-            axs.legend()
-            axs.grid()
-            axs.plot()
-        elif profile_type == "Temp":
-            fig, axs = plt.subplots(figsize=(width,height))
-            for flight in flights:
-                axs.errorbar(flight.avg_temp_at_height, flight.heights, 
-                     xerr=flight.temp_at_height_stdev, capsize=6, marker="D", 
-                     label=f'Starting at {flight.start_time}')
-                
-            axs.set_xlabel('Temperature °C', fontsize=xlabel_size)
-            axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
-            axs.legend()
-            axs.grid()
-            axs.plot()            
+    def plot_profile(flights, *args, **kwargs):
+        """ Creates a plot of the profile for a flight day. Matplotlib is only
+        imported on the first call; see ProfilePlots.plot_profile for the
+        keyword arguments.
+        
+        :param flights: Profile objects, as a list or any iterable such as\
+            Profile.load_many
+        """
+        from ProfilePlots import plot_profile
+        return plot_profile(flights, *args, **kwargs)
     
     @staticmethod
-    def plot_scatter_profile(flights, profile_type = "CO2", width = 7,
-                             height = 10, xlabel_size = 14, ylabel_size = 14,
-                             marker = 'o', marker_size = 2):
-        
-        if profile_type == "CO2":
-            fig, axs = plt.subplots(figsize=(width,height))
-            for flight in flights:
-                axs.scatter(flight.avg_ppm_list, flight.altitude_list,
-                            marker = marker, s = marker_size,
-                            label=f'Starting at {flight.start_time}')
-                
-            axs.set_xlabel('CO2 ppm', fontsize=xlabel_size)
-            axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
-            axs.legend()
-            axs.grid()
-            axs.plot()
-        
-        
-        
-        
-        
-        
-        
-        
-        
-        
+    def plot_scatter_profile(flights, *args, **kwargs):
+        """ Creates a scatterplot of the corrected CO2 readings against
+        altitude. Matplotlib is only imported on the first call; see
+        ProfilePlots.plot_scatter_profile for the keyword arguments.
         
-    
\ No newline at end of file
+        :param flights: Profile objects, as a list or any iterable such as\
+            Profile.load_many
+        """
+        from ProfilePlots import plot_scatter_profile
+        return plot_scatter_profile(flights, *args, **kwargs)
+
+
+def _profile_from_config(flight):
+    """ Returns the Profile for one flight of a main() configuration
+    """
+    flight = dict(flight)
+    flightNum = flight.pop("flightNum")
+    start_time = flight.pop("start_time", None)
+    end_time = flight.pop("end_time", None)
+    from_bin = flight.pop("bin", False)
+    align = flight.pop("align", False)
+    
+    data = None
+    if (from_bin):
+        data = FlightData.from_BIN(flightNum, start_time, end_time, align=align,
+                                   calibration=flight.get("calibration"))
+    elif (start_time is not None or end_time is not None):
+        data = FlightData(f"{str(flightNum).zfill(8)}ALL.csv", flight.get("calibration"))
+        data = data.trim(-np.inf if start_time is None else start_time,
+                         np.inf if end_time is None else end_time)
+    if (data is not None):
+        flight.pop("calibration", None)
+    
+    cache_dir = flight.pop("cache_dir", None)
+    if (cache_dir is None):
+        return Profile(flightNum, data=data, **flight)
+    return Profile.cached(flightNum, cache_dir=cache_dir, data=data, **flight)
+
+def _try_profile_from_config(flight):
+    """ Returns (flightNum, Profile, None) for one flight of a main()
+    configuration, or (flightNum, None, error message) if it fails
+    """
+    try:
+        if (flight.get("heights") is None):
+            raise ValueError("heights are needed to run without prompts")
+        return flight.get("flightNum"), _profile_from_config(flight), None
+    except Exception as error:
+        return flight.get("flightNum"), None, f"{type(error).__name__}: {error}"
+
+def main(argv = None):
+    """ Creates the Profiles for every flight in a JSON configuration file
+    without any prompts and writes their height averages to a CSV file.
+    
+    The configuration holds a list of flights, each with a flightNum and any
+    Profile arguments (heights as a list or grid specification, correction,
+    derived, ...). A flight with start_time or end_time is trimmed from its
+    ALL csv in memory, and one with "bin": true is read straight from its
+    BIN file (with "align" for the aligned merge); otherwise its
+    ALL_TRIMMED csv is read. Settings under "defaults" apply to every
+    flight. Optional top-level settings are "output" (the CSV file;
+    "profiles.csv" by default), "plot" (an image file for plot_profile),
+    "cache_dir" (to reuse results with Profile.cached), and "max_workers".
+    A flight that fails is reported and skipped, the others are still
+    written, and main returns 1 if any flight failed.
+    
+    Ex) python FlightData.py campaign.json
+    """
+    parser = argparse.ArgumentParser(description="Create Profiles for the flights in a JSON configuration file")
+    parser.add_argument("config", help="path to the JSON configuration file")
+    parser.add_argument("--workers", type=int, default=None, help="number of flights processed at the same time")
+    parser.add_argument("--threads", action="store_true", help="use threads instead of processes")
+    args = parser.parse_args(argv)
+    
+    with open(args.config, 'r') as read_file:
+        config = json.load(read_file)
+    
+    defaults = dict(config.get("defaults", {}))
+    if ("cache_dir" in config):
+        defaults.setdefault("cache_dir", config["cache_dir"])
+    flights = [{**defaults, **flight} for flight in config["flights"]]
+    
+    max_workers = args.workers or config.get("max_workers", os.cpu_count() or 1)
+    profiles = []
+    rows = []
+    failed = []
+    for flightNum, profile, error in _load_concurrently(_try_profile_from_config, flights,
+                                                        max_workers, not args.threads):
+        if (profile is None):
+            print(f"Skipping flight {flightNum}: {error}")
+            failed.append(flightNum)
+            continue
+        profiles.append(profile)
+        for i, height in enumerate(profile.heights):
+            row = {"flightNum": profile.flightNum,
+                   "start_time": profile.start_time,
+                   "correction": profile.get_correction(),
+                   "height": height,
+                   "count": profile.count_at_height[i],
+                   "avg_ppm": profile.avg_ppm_at_height[i],
+                   "ppm_stdev": profile.ppm_at_height_stdev[i],
+                   "avg_temp": profile.avg_temp_at_height[i],
+                   "temp_stdev": profile.temp_at_height_stdev[i]}
+            if (profile.ppm_ci_at_height is not None):
+                row.update(ppm_ci_lower=profile.ppm_ci_at_height[0][i],
+                           ppm_ci_upper=profile.ppm_ci_at_height[1][i],
+                           temp_ci_lower=profile.temp_ci_at_height[0][i],
+                           temp_ci_upper=profile.temp_ci_at_height[1][i])
+            for name in profile.avg_derived_at_height:
+                row[f"avg_{name}"] = profile.avg_derived_at_height[name][i]
+                row[f"{name}_stdev"] = profile.derived_stdev_at_height[name][i]
+            rows.append(row)
+        print(f"Profile for flight {profile.flightNum} is done")
+    
+    output = config.get("output", "profiles.csv")
+    summary = pd.DataFrame(rows, columns=None if rows else ["flightNum", "start_time", "correction", "height", "count",
+                                                            "avg_ppm", "ppm_stdev", "avg_temp", "temp_stdev"])
+    summary.sort_values(["flightNum", "height"], kind="stable").to_csv(output, index=False)
+    print(f"{output} has been generated")
+    
+    if ("plot" in config and profiles):
+        import matplotlib
+        matplotlib.use("Agg")
+        from ProfilePlots import plt
+        Profile.plot_profile(profiles)
+        plt.savefig(config["plot"])
+        print(f"{config['plot']} has been generated")
+    
+    if (failed):
+        print(f"{len(failed)} of {len(flights)} flights failed: {', '.join(str(flightNum) for flightNum in failed)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
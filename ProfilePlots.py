@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Plotting functions for Profile objects. These live in their own module so
+that importing FlightData does not import matplotlib; Profile.plot_profile
+and Profile.plot_scatter_profile load this module on first use.
+"""
+from matplotlib import pyplot as plt
+
+def plot_profile(flights, profile_type = "CO2", width = 7,
+                 height = 10, xlabel_size = 14, ylabel_size = 14,
+                 capsize = 6, marker = "D"):
+    """ Creates a plot of the profile for a flight day.
+
+    :param flights: Profile objects, as a list or any iterable such as
+    Profile.load_many; each flight is drawn as it arrives\n
+    :param str profile_type: String containing the name of
+    the parameter to be plotted (default "CO2," or "Temp").\n
+    :param int width: width of the plot in inches; 7 default\n
+    :param int height: height of the plot in inches; 10 default\n
+    :param int xlabel_size: xlabel fontsize; 14 default\n
+    :param int ylabel_size: ylabel fontsize; 14 default\n
+    """
+    if profile_type == "CO2":
+        fig, axs = plt.subplots(figsize=(width,height))
+        for flight in flights:
+            axs.errorbar(flight.avg_ppm_at_height, flight.heights, 
+                 xerr=flight.ppm_at_height_stdev, capsize=capsize, marker=marker, 
+                 label=f'Starting at {flight.start_time}')
+
+        axs.set_xlabel('CO2 ppm', fontsize=xlabel_size)
+        axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
+        axs.legend()
+        axs.grid()
+        axs.plot()
+    elif profile_type == "Temp":
+        fig, axs = plt.subplots(figsize=(width,height))
+        for flight in flights:
+            axs.errorbar(flight.avg_temp_at_height, flight.heights, 
+                 xerr=flight.temp_at_height_stdev, capsize=6, marker="D", 
+                 label=f'Starting at {flight.start_time}')
+
+        axs.set_xlabel('Temperature °C', fontsize=xlabel_size)
+        axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
+        axs.legend()
+        axs.grid()
+        axs.plot()            
+
+def plot_scatter_profile(flights, profile_type = "CO2", width = 7,
+                         height = 10, xlabel_size = 14, ylabel_size = 14,
+                         marker = 'o', marker_size = 2):
+    """ Creates a scatterplot of the corrected CO2 readings against altitude.
+
+    :param flights: Profile objects, as a list or any iterable such as
+    Profile.load_many; each flight is drawn as it arrives\n
+    :param str profile_type: String containing the name of
+    the parameter to be plotted (default "CO2").\n
+    :param int width: width of the plot in inches; 7 default\n
+    :param int height: height of the plot in inches; 10 default\n
+    :param int xlabel_size: xlabel fontsize; 14 default\n
+    :param int ylabel_size: ylabel fontsize; 14 default\n
+    :param int marker_size: marker size; 2 default\n
+    """
+    if profile_type == "CO2":
+        fig, axs = plt.subplots(figsize=(width,height))
+        for flight in flights:
+            axs.scatter(flight.avg_ppm_list, flight.altitude_list,
+                        marker = marker, s = marker_size,
+                        label=f'Starting at {flight.start_time}')
+
+        axs.set_xlabel('CO2 ppm', fontsize=xlabel_size)
+        axs.set_ylabel('Altitude (in meters)', fontsize=ylabel_size)
+        axs.legend()
+        axs.grid()
+        axs.plot()